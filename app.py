@@ -3,6 +3,8 @@ import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objects as go
 import dash_daq as daq
+from dash.exceptions import PreventUpdate
+from types import MappingProxyType
 
 
 #Custom python file made for data wrangling and generating the graph objects to be used
@@ -10,6 +12,8 @@ from clean_honey_data import *
 import pandas as pd
 
 #import data
+#Every figure is built from these at load (see PRE PROCESSING), so the
+#callbacks never touch them and request threads share nothing mutable
 honey_data = pd.read_csv('all_honey_data.csv')
 colony_data = pd.read_csv('all_colony_data.csv')
 
@@ -17,7 +21,10 @@ colony_data = pd.read_csv('all_colony_data.csv')
 
 #Create slider values to be used in layout
 period_vals = list(colony_data.period.unique())
-slider_markers = {i+1: period_vals[i] for i in range(len(period_vals))}
+slider_markers = MappingProxyType({i+1: period_vals[i] for i in range(len(period_vals))})
+
+#Years available on the bubble chart slider
+bubble_years = range(2000, 2019)
 
 #colony stressors to be mapped onto choropleth map
 stressors = ["varroa_mites", "other_pests", "other", "pesticides", "unknown", "diseases", "lost_perc"]
@@ -29,6 +36,53 @@ stressors2 = ["varroa_mites", "other_pests", "pesticides", "diseases", "lost_per
 state_dropdown = get_state_dropdown()
 state_names = get_state_names()
 
+#Rolling means, quarter over quarter deltas and z-score anomalies for every
+#state, period and stressor, computed once so callbacks only index arrays
+stressor_trends = compute_stressor_trends(colony_data, stressors)
+
+#Default selections shown when the page first loads
+default_stressor = 'varroa_mites'
+default_period = 1
+default_anomaly = False
+default_state = 'California'
+default_year = 2000
+
+#Precompute every figure the inputs can select, keyed by the input values.
+#The callbacks only look figures up in these read-only mappings, so they are
+#safe to serve from many threads and their size is fixed at load
+map_figures = MappingProxyType({
+    (stressor_, period_, anomaly_): generate_anomaly_map_object(stressor_trends, slider_markers[period_], stressor_)
+                                    if anomaly_ else
+                                    generate_map_object(colony_data, slider_markers[period_], stressor_)
+    for stressor_ in stressor_keys for period_ in slider_markers for anomaly_ in (False, True)})
+
+#States in the dropdown without colony data get a placeholder figure
+line_plot_figures = MappingProxyType({
+    state_: generate_line_plot(colony_data, stressors2, state_, stressor_trends)
+            if state_ in stressor_trends['state_ix'] else
+            generate_no_data_plot(state_)
+    for state_ in state_names})
+
+bubble_plot_figures = MappingProxyType({
+    year_: generate_bubble_chart(honey_data, year_, 10) for year_ in bubble_years})
+
+#Figures for the default selections are embedded in the layout so the
+#first paint needs no callback round trips
+default_map = map_figures[(default_stressor, default_period, default_anomaly)]
+default_line_plot = line_plot_figures[default_state]
+default_bubble_plot = bubble_plot_figures[default_year]
+
+
+def lookup_figure(figures_, key_):
+    '''
+    Returns the precomputed figure for a set of callback inputs. Inputs
+    outside the known values leave the current figure in place.
+    '''
+    try:
+        return figures_[key_]
+    except (KeyError, TypeError):
+        raise PreventUpdate
+
 
 
 
@@ -137,7 +191,18 @@ app.layout = html.Div(children=[
                                     ],
                                     
                                     #Set default value to varroa mites
-                                    value='varroa_mites'
+                                    value=default_stressor
+                            ),
+                    ], style={'margin-bottom':'2%'}),
+
+                    #Toggle between stressor levels and anomaly z-scores
+                    html.Div(
+                        className = 'three columns',
+                        children=[
+                            daq.ToggleSwitch(
+                                    id = 'anomaly-toggle',
+                                    label = 'Anomaly overlay',
+                                    value = default_anomaly
                             ),
                     ], style={'margin-bottom':'2%'}),
             
@@ -145,7 +210,7 @@ app.layout = html.Div(children=[
                     #Create div to contain choropleth map
                     
                     html.Div([
-                            dcc.Graph(id='us-map')
+                            dcc.Graph(id='us-map', figure=default_map)
                     ]),
 
                     html.Div(
@@ -155,8 +220,8 @@ app.layout = html.Div(children=[
                                         id = 'slider1',
                                         min=1,
                                         max=16,
-                                        marks = slider_markers,
-                                        value=1,
+                                        marks = dict(slider_markers),
+                                        value=default_period,
                                         size = 700,
                                         handleLabel={"showCurrentValue":True, "label": "VALUE"}
                                 ),
@@ -185,12 +250,12 @@ app.layout = html.Div(children=[
                             dcc.Dropdown(
                                     id = 'dropdown2',
                                     options=state_dropdown,
-                                    value='California'
+                                    value=default_state
                             ),
                         ], style={'margin-bottom':'2%'}),
             
                     #Line plot
-                    html.Div([dcc.Graph(id='state-line-plot')]),
+                    html.Div([dcc.Graph(id='state-line-plot', figure=default_line_plot)]),
         
                 ]),
         
@@ -199,16 +264,16 @@ app.layout = html.Div(children=[
                     className = 'input_container mini_container',
                     children = [
                     #div that contains bubbble chart
-                	 html.Div([dcc.Graph(id='bubble-plot')]),
+                	 html.Div([dcc.Graph(id='bubble-plot', figure=default_bubble_plot)]),
                 	 #slider to bubble chart
                 	 html.Div(
                             [
                                 daq.Slider(
                                     id = 'slider2',
-                              		min=2000,
-                              		max=2018,
-                                    marks={i: 'Label {}'.format(i) if i == 1 else str(i) for i in range(2000, 2019)},
-                                    value=2000,
+                              		min=bubble_years[0],
+                              		max=bubble_years[-1],
+                                    marks={i: 'Label {}'.format(i) if i == 1 else str(i) for i in bubble_years},
+                                    value=default_year,
                                     size = 700,
                                     handleLabel={"showCurrentValue":True, "label": "VALUE"}
                                 ),
@@ -223,21 +288,25 @@ app.layout = html.Div(children=[
 
 #-------------------------CALLBACKS to udpate figures-------------------------------------------
 
+#The default figures are already embedded in the layout, so each callback
+#sets prevent_initial_call and only fires once the user changes an input
+
+#Each callback only looks its figure up in the mappings built at load
+
 #Create callback for us choropleth map
-#The map is reactive to two inputs, which are the slider and dropdown
+#The map is reactive to three inputs, which are the slider, dropdown and anomaly toggle
 #Thus they are placed in a list to indicate that there are multiple inputs
 #for the figure with id 'us-map'
 @app.callback(
     dash.dependencies.Output('us-map', 'figure'),
-    [dash.dependencies.Input('dropdown1', 'value'), dash.dependencies.Input('slider1', 'value')])
-def update_map(dropdown_, slider_):
+    [dash.dependencies.Input('dropdown1', 'value'), dash.dependencies.Input('slider1', 'value'),
+     dash.dependencies.Input('anomaly-toggle', 'value')],
+    prevent_initial_call=True)
+def update_map(dropdown_, slider_, anomaly_):
     
-    for i in stressors:
-        if i in dropdown_:
-            #Call generate_map_object from clean_colony_data.py
-            fig = generate_map_object(colony_data, slider_markers[slider_], dropdown_)
-            figure = fig
-    return figure
+    #Figures from generate_map_object, or generate_anomaly_map_object
+    #when the anomaly toggle is on
+    return lookup_figure(map_figures, (dropdown_, slider_, anomaly_))
 
 
 
@@ -245,15 +314,11 @@ def update_map(dropdown_, slider_):
 #The plot is reactive to one input, which is dropdown selector with state names
 @app.callback(
     dash.dependencies.Output('state-line-plot', 'figure'),
-    [dash.dependencies.Input('dropdown2', 'value')])
+    [dash.dependencies.Input('dropdown2', 'value')],
+    prevent_initial_call=True)
 def update_line_plot(dropdown_):
     
-    for i in state_names:
-        if i in dropdown_:
-            fig = generate_line_plot(colony_data, stressors2, dropdown_)
-            figure = fig
-            
-    return figure
+    return lookup_figure(line_plot_figures, dropdown_)
 
 
 
@@ -262,14 +327,14 @@ def update_line_plot(dropdown_):
 
 @app.callback(
     dash.dependencies.Output('bubble-plot', 'figure'),
-    [dash.dependencies.Input('slider2', 'value')])
+    [dash.dependencies.Input('slider2', 'value')],
+    prevent_initial_call=True)
 def update_bubble_plot(slider_):
     
-   #Call generaete_bubble_chart from clean_colony_data.py
+   #Figures from generaete_bubble_chart in clean_colony_data.py
    #value n can be adjusted for the number of data points
    #on the plot. n = 15
-   figure = generate_bubble_chart(honey_data, slider_, 10)
-   return figure
+   return lookup_figure(bubble_plot_figures, slider_)
 
 #---------------------launch app----------------------------------------------
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
+from types import MappingProxyType
 
 
 us_state_abbrev = {
@@ -64,6 +65,14 @@ us_state_abbrev = {
 
 abbrev_us_state = dict(map(reversed, us_state_abbrev.items()))
 
+
+stressor_keys = {'varroa_mites': "Varroa Mites",
+                 'pesticides': "Pesticides",
+                 'other': 'Other Categories (Weather, Starvation, etc.)',
+                 'unknown': 'Unknown Causes',
+                 'other_pests': 'Other Pests (Tracheal Mites, Hive Beetles, Wax Moths, etc.)',
+                 'diseases': 'Diseases (Foulbrood, Chalkbrood, Stonebrood, Paralysis)'}
+
 def get_state_dropdown():
     dict_list= []
     for i in us_state_abbrev.keys():
@@ -80,6 +89,93 @@ def get_state_names():
 
 
 
+def compute_stressor_trends(input_, col_names, window=4, threshold=2.0):
+    '''
+    Returns rolling means, quarter over quarter deltas and z-score anomalies
+    for every state, period and stressor, computed in one vectorized pass
+    over a state x period x stressor array.
+
+    input:
+        input_: DataFrame containing the colony data
+        col_names: Names of the stressor columns to include
+        window: Number of quarters used for the rolling mean and for the
+                trailing baseline the z-scores are measured against
+        threshold: z-score at or above which a value is flagged as a spike
+
+    returns:
+        trends: Read-only mapping containing the axis labels ('states',
+                'periods', 'stressors'), their index lookups ('state_ix',
+                'period_ix', 'stressor_ix') and arrays of shape
+                (states, periods, stressors) for 'values', 'rolling_mean',
+                'delta', 'baseline_mean', 'baseline_std', 'zscore' and
+                'anomalies'. The baseline is the `window` quarters before
+                each period, so a spike only ever depends on earlier data.
+                Its std is the sample std (ddof=1). Missing observations,
+                and periods without `window` prior observations, are NaN
+                and never flagged. Nothing in the mapping can be mutated,
+                so it is safe to share between threads.
+    '''
+    states = sorted(input_.state.unique())
+    periods = sorted(input_.period.unique())
+
+    #Reindex onto the full grid so missing state/period rows become NaN
+    full_ix = pd.MultiIndex.from_product([states, periods], names=['state', 'period'])
+    values = input_.set_index(['state', 'period'])[col_names].reindex(full_ix)
+    values = values.to_numpy(dtype=float).reshape(len(states), len(periods), len(col_names))
+
+    observed = ~np.isnan(values)
+    pad = np.zeros((len(states), 1, len(col_names)))
+
+    #Rolling mean from cumulative sums, skipping NaN and allowing partial windows
+    csum = np.concatenate([pad, np.cumsum(np.where(observed, values, 0.0), axis=1)], axis=1)
+    ccount = np.concatenate([pad, np.cumsum(observed, axis=1)], axis=1)
+    lag = np.maximum(np.arange(1, len(periods) + 1) - window, 0)
+    win_sum = csum[:, 1:] - csum[:, lag]
+    win_count = ccount[:, 1:] - ccount[:, lag]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rolling_mean = np.where(win_count > 0, win_sum / win_count, np.nan)
+
+        #Quarter over quarter change, undefined for the first period
+        delta = np.concatenate([np.full_like(pad, np.nan), np.diff(values, axis=1)], axis=1)
+
+        #Trailing baseline from the previous `window` quarters, stacked as
+        #lagged copies of the array so the whole grid is handled at once
+        lagged = np.stack([np.concatenate([np.full((len(states), n, len(col_names)), np.nan),
+                                           values[:, :-n]], axis=1)
+                           for n in range(1, window + 1)])
+        lag_observed = ~np.isnan(lagged)
+        lag_count = lag_observed.sum(axis=0)
+        has_baseline = lag_count >= window
+        baseline_mean = np.where(has_baseline, np.where(lag_observed, lagged, 0.0).sum(axis=0) / lag_count, np.nan)
+        sq_dev = np.where(lag_observed, (lagged - baseline_mean) ** 2, 0.0)
+        baseline_std = np.where(has_baseline, np.sqrt(sq_dev.sum(axis=0) / (lag_count - 1)), np.nan)
+
+        #z-score of each value against its trailing baseline. A flat baseline
+        #can leave rounding noise in the std, so treat near zero as zero
+        zscore = np.where(baseline_std > 1e-9, (values - baseline_mean) / baseline_std, np.nan)
+        anomalies = zscore >= threshold
+
+    arrays = {'values': values,
+              'rolling_mean': rolling_mean,
+              'delta': delta,
+              'baseline_mean': baseline_mean,
+              'baseline_std': baseline_std,
+              'zscore': zscore,
+              'anomalies': anomalies}
+    for arr in arrays.values():
+        arr.flags.writeable = False
+
+    return MappingProxyType(dict(
+            states=tuple(states),
+            periods=tuple(periods),
+            stressors=tuple(col_names),
+            state_ix=MappingProxyType({s: i for i, s in enumerate(states)}),
+            period_ix=MappingProxyType({q: i for i, q in enumerate(periods)}),
+            stressor_ix=MappingProxyType({c: i for i, c in enumerate(col_names)}),
+            **arrays))
+
+
 def generate_map_object(input_, period_, category_):
     '''
     Returns a plotly chloropleth graph object
@@ -107,13 +203,6 @@ def generate_map_object(input_, period_, category_):
     
     df = input_[input_['period'] == period_]
     
-    stressor_keys = {'varroa_mites': "Varroa Mites",
-                 'pesticides': "Pesticides",
-                 'other': 'Other Categories (Weather, Starvation, etc.)',
-                 'unknown': 'Unknown Causes',
-                 'other_pests': 'Other Pests (Tracheal Mites, Hive Beetles, Wax Moths, etc.)',
-                'diseases': 'Diseases (Foulbrood, Chalkbrood, Stonebrood, Paralysis)'}
-    
     fig = go.Figure(data=go.Choropleth(
        
         locations=df.state_code,
@@ -144,7 +233,68 @@ def generate_map_object(input_, period_, category_):
     return fig
 
 
-def generate_line_plot(input_, col_names, state_):
+def generate_anomaly_map_object(trends_, period_, category_):
+    '''
+    Returns a plotly chloropleth graph object shading each state by the
+    z-score of a stressor for one period, served from precomputed trends
+
+    input:
+        trends_: Output of compute_stressor_trends
+        period_: A string value containing the year and quarter. Ex: '2015Q1'
+        category_: The stressor column to display
+
+    returns:
+        fig: A chloropleth graph object
+    '''
+    p = trends_['period_ix'][period_]
+    k = trends_['stressor_ix'][category_]
+    states = trends_['states']
+    z = trends_['zscore'][:, p, k]
+    delta = trends_['delta'][:, p, k]
+    rolling_mean = trends_['rolling_mean'][:, p, k]
+
+    def fmt(val, spec):
+        return 'n/a' if np.isnan(val) else spec.format(val)
+
+    hover = ['{}<br>Change from last quarter: {}<br>Rolling mean: {}{}'.format(
+                s, fmt(d, '{:+.1f}%'), fmt(r, '{:.1f}%'), '<br><b>Spike</b>' if a else '')
+             for s, d, r, a in zip(states, delta, rolling_mean, trends_['anomalies'][:, p, k])]
+
+    #The first quarters have no trailing baseline, so nothing can be scored
+    if np.isnan(z).all():
+        subtitle = '<br>(not enough history for a z-score in this quarter)'
+    else:
+        subtitle = '<br>(z-score against the preceding quarters)'
+
+    fig = go.Figure(data=go.Choropleth(
+        locations=[us_state_abbrev[s] for s in states],
+        z=z,
+        zmin=-3,
+        zmax=3,
+        locationmode='USA-states',
+        colorscale='RdBu',
+        reversescale=True,
+        autocolorscale=False,
+        text=hover,
+        marker_line_color='white',
+        colorbar_title="z-score"
+    ))
+
+    fig.update_layout(
+        height=500,
+        width=700,
+        title_text='Anomalies In Colonies Affected By ' + stressor_keys[category_] + " " + str(period_) + subtitle,
+        geo = dict(
+            scope='usa',
+            projection=go.layout.geo.Projection(type = 'albers usa'),
+            showlakes=True,
+            lakecolor='rgb(255, 255, 255)'),
+    )
+
+    return fig
+
+
+def generate_line_plot(input_, col_names, state_, trends_=None):
     '''
     Returns a multiline graph object of stressors for a specfic US state.
     
@@ -152,6 +302,9 @@ def generate_line_plot(input_, col_names, state_):
         input_: DataFrame containing data
         col_names: Names of lines to be traced
         state_: Name of US State the
+        trends_: Optional output of compute_stressor_trends. When given,
+                 quarters flagged as spikes are annotated with their
+                 change from the previous quarter.
     
     output
     '''
@@ -188,6 +341,20 @@ def generate_line_plot(input_, col_names, state_):
             text = '{}%'.format(round(max_val,2)),
             textposition = 'middle right'
         ))
+
+        # spikes
+        if trends_ is not None and state_ in trends_['state_ix']:
+            s_ix = trends_['state_ix'][state_]
+            k_ix = trends_['stressor_ix'][i]
+            for p_ix in np.flatnonzero(trends_['anomalies'][s_ix, :, k_ix]):
+                delta_ = trends_['delta'][s_ix, p_ix, k_ix]
+                annotations.append(dict(x=trends_['periods'][p_ix],
+                                        y=trends_['values'][s_ix, p_ix, k_ix],
+                                        xref='x', yref='y',
+                                        text='spike' if np.isnan(delta_) else '{:+.1f}%'.format(delta_),
+                                        font=dict(family='Arial', size=11, color=color_),
+                                        showarrow=True, arrowhead=2, arrowcolor=color_,
+                                        ax=0, ay=-30))
         
         color_ix = color_ix + 1
         
@@ -253,6 +420,36 @@ def generate_line_plot(input_, col_names, state_):
     return fig
 
 
+def generate_no_data_plot(state_):
+    '''
+    Returns an empty graph object stating that a US state has no colony data,
+    shown in place of the multiline graph for that state.
+
+    input parameters:
+        state_: Name of US State
+
+    output:
+        fig: Plotly graph object
+    '''
+    fig = go.Figure()
+    fig.update_layout(
+        width = 700,
+        height = 500,
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        plot_bgcolor='white',
+        annotations=[dict(xref='paper', yref='paper', x=0.5, y=0.5,
+                          xanchor='center', yanchor='middle',
+                          text='No colony data for ' + state_,
+                          font=dict(family='Arial',
+                                    size=24,
+                                    color='rgb(150,150,150)'),
+                          showarrow=False)]
+    )
+
+    return fig
+
+
 def generate_bubble_chart(input_, year_, n):
     '''
     Returns a graph object that produces a bubble chart
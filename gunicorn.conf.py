@@ -0,0 +1,18 @@
+#Gunicorn settings, read from the working directory when the Procfile starts gunicorn
+import os
+
+#Load the app once in the master so the data and the precomputed figures
+#are shared copy-on-write with every worker
+preload_app = True
+
+#gthread workers serve requests from a thread pool in each process. The
+#callbacks only look figures up in read-only mappings, so threads share
+#nothing mutable
+worker_class = 'gthread'
+
+#Serving a figure is CPU bound (JSON serialization under the GIL), so extra
+#threads do not add throughput on their own; they keep one slow client from
+#blocking a worker. Measure with scripts/load_test.py. Multi-core scaling has
+#not been measured. The number of workers is left to gunicorn's default,
+#which reads WEB_CONCURRENCY (set by Heroku to suit the dyno size)
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
@@ -0,0 +1,134 @@
+#Load test for the dashboard callbacks. For each workers x threads
+#configuration it starts gunicorn with gunicorn.conf.py, replays randomized
+#callback payloads from concurrent clients, and checks every response
+#against the precomputed figure mappings in app.py. Run from anywhere:
+#    python scripts/load_test.py 1x1 1x2 2x2
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+os.chdir(root)
+
+import plotly
+import app
+
+#Number of distinct payloads, times each is replayed, and concurrent clients
+n_payloads = 400
+n_rounds = 3
+n_clients = 16
+port = 8051
+
+
+def callback_payload(output_, inputs_):
+    '''
+    Returns the request body the Dash renderer sends when the given
+    inputs change, for a callback whose output is output_.figure
+    '''
+    return json.dumps({'output': output_ + '.figure',
+                       'outputs': {'id': output_, 'property': 'figure'},
+                       'inputs': [{'id': i, 'property': 'value', 'value': v} for i, v in inputs_],
+                       'changedPropIds': []})
+
+
+def expected_figure(figure_):
+    '''
+    Returns a figure as the JSON the server should send for it
+    '''
+    return json.loads(json.dumps(figure_, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def build_cases(seed_=0):
+    '''
+    Returns a list of (output id, payload, expected figure) drawn at random
+    from every input combination the layout can produce
+    '''
+    rng = random.Random(seed_)
+    cases = []
+    for _ in range(n_payloads):
+        pick = rng.random()
+        if pick < 0.4:
+            key = rng.choice(list(app.map_figures))
+            inputs = [('dropdown1', key[0]), ('slider1', key[1]), ('anomaly-toggle', key[2])]
+            cases.append(('us-map', callback_payload('us-map', inputs), app.map_figures[key]))
+        elif pick < 0.7:
+            state_ = rng.choice(list(app.line_plot_figures))
+            cases.append(('state-line-plot', callback_payload('state-line-plot', [('dropdown2', state_)]),
+                          app.line_plot_figures[state_]))
+        else:
+            year_ = rng.choice(list(app.bubble_plot_figures))
+            cases.append(('bubble-plot', callback_payload('bubble-plot', [('slider2', year_)]),
+                          app.bubble_plot_figures[year_]))
+    return [(output_, payload_, expected_figure(fig_)) for output_, payload_, fig_ in cases]
+
+
+def wait_for_server(timeout_=60):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout_:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('GET', '/_dash-layout')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start within {} s'.format(timeout_))
+
+
+def run(workers_, threads_, cases_):
+    '''
+    Returns (requests per second, number of mismatched figures) for one
+    gunicorn configuration
+    '''
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:server',
+                               '--workers', str(workers_), '--threads', str(threads_),
+                               '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'error'])
+    try:
+        wait_for_server()
+        jobs = iter(range(len(cases_) * n_rounds))
+        lock = threading.Lock()
+        mismatches = [0]
+
+        def client():
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            while True:
+                with lock:
+                    job = next(jobs, None)
+                if job is None:
+                    return
+                output_, payload_, expected_ = cases_[job % len(cases_)]
+                conn.request('POST', '/_dash-update-component', payload_,
+                             {'Content-Type': 'application/json'})
+                response = json.loads(conn.getresponse().read())
+                if response['response'][output_]['figure'] != expected_:
+                    with lock:
+                        mismatches[0] += 1
+
+        start = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(n_clients)]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    return len(cases_) * n_rounds / elapsed, mismatches[0]
+
+
+if __name__ == '__main__':
+    configs = sys.argv[1:] or ['1x1', '1x2', '1x4', '2x2']
+    cases = build_cases()
+    print('cpus: {}, clients: {}, requests per run: {}'.format(os.cpu_count(), n_clients, len(cases) * n_rounds))
+    for config in configs:
+        workers, threads = (int(n) for n in config.split('x'))
+        rate, bad = run(workers, threads, cases)
+        print('workers={} threads={}: {:.0f} req/s, mismatched figures: {}'.format(workers, threads, rate, bad))
@@ -0,0 +1,54 @@
+#Measures server-side time-to-first-render for the dashboard: the layout
+#request plus every callback Dash fires on page load (callbacks without
+#prevent_initial_call). Run from the repository root:
+#    python scripts/measure_first_render.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+
+import app
+
+#Repeat the page load this many times and report the median
+n_runs = 20
+
+
+def callback_payload(callback_):
+    '''
+    Returns the request body the Dash renderer sends for a callback,
+    using the initial values of its inputs from the layout
+    '''
+    values = {}
+    def collect(component_):
+        if hasattr(component_, 'id') and hasattr(component_, 'value'):
+            values[component_.id] = component_.value
+        for child in getattr(component_, 'children', None) or []:
+            if not isinstance(child, str):
+                collect(child)
+    collect(app.app.layout)
+
+    output_id, output_prop = callback_['output'].split('.')
+    return {'output': callback_['output'],
+            'outputs': {'id': output_id, 'property': output_prop},
+            'inputs': [{'id': i['id'], 'property': i['property'], 'value': values[i['id']]}
+                       for i in callback_['inputs']],
+            'changedPropIds': []}
+
+
+client = app.server.test_client()
+dependencies = client.get('/_dash-dependencies').get_json()
+initial_callbacks = [callback_payload(c) for c in dependencies if not c.get('prevent_initial_call')]
+
+timings = []
+for _ in range(n_runs):
+    start = time.perf_counter()
+    client.get('/_dash-layout')
+    for payload in initial_callbacks:
+        assert client.post('/_dash-update-component', json=payload).status_code == 200
+    timings.append(time.perf_counter() - start)
+
+timings.sort()
+print('initial callbacks fired: {}'.format(len(initial_callbacks)))
+print('median time-to-first-render: {:.1f} ms'.format(timings[n_runs // 2] * 1000))